@@ -6,7 +6,7 @@ This module performs comprehensive spectral calibration for smartphone cameras u
 - 6-color regions (red, green, blue, cyan, magenta, yellow)
 - 4 black corner regions for shadow/noise baseline
 - Shadow correction via black level subtraction
-- Polynomial/spline correction curve fitting
+- Polynomial correction curve fitting
 - Calibration data persistence for future use
 
 Author: AI Assistant
@@ -15,13 +15,231 @@ Date: 2025-10-24
 
 import cv2
 import numpy as np
-import sys
 import json
-from typing import Dict, List, Tuple, Optional
-from scipy.interpolate import UnivariateSpline, interp1d
-from scipy.optimize import curve_fit
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Tuple, Optional, Union
 from datetime import datetime
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional - pixel classification falls back to NumPy
+    njit = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional - calibration files fall back to the stdlib encoder
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+_color_pool = None
+_color_pool_lock = threading.Lock()
+
+
+def _get_color_pool() -> ThreadPoolExecutor:
+    """Return the shared per-color worker pool, creating it on first use"""
+    global _color_pool
+    
+    with _color_pool_lock:
+        if _color_pool is None:
+            workers = min(6, os.cpu_count() or 1)
+            _color_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='spectral-color')
+    
+    return _color_pool
+
+
+_scratch = threading.local()
+
+
+def _scratch_mask(height: int, width: int) -> np.ndarray:
+    """
+    Return this thread's reusable uint8 mask buffer viewed as (height, width)
+    
+    The buffer only grows, so back-to-back requests at the same resolution
+    reuse the same pages. Contents are overwritten by the next call on the
+    same thread.
+    """
+    buf = getattr(_scratch, 'mask', None)
+    
+    if buf is None or buf.size < height * width:
+        buf = np.empty(height * width, dtype=np.uint8)
+        _scratch.mask = buf
+    
+    return buf[:height * width].reshape(height, width)
+
+
+def _build_hsv_lookup(hsv_ranges: Dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Build a hue -> color bitmask table plus per-color S/V minimums from HSV ranges
+    
+    Color i in the order of hsv_ranges owns bit i, so a hue shared by two
+    ranges (e.g. 80 for green/cyan) carries both bits, as it would with
+    separate inRange masks. Upper S/V bounds are all 255 and therefore not
+    stored.
+    
+    Args:
+        hsv_ranges: Mapping of color name to [lower, upper, ...] HSV tuples
+        
+    Returns:
+        Tuple of (hue_bits[180], s_min[n], v_min[n]) uint8 arrays
+    """
+    hue_bits = np.zeros(180, dtype=np.uint8)
+    s_min = np.zeros(len(hsv_ranges), dtype=np.uint8)
+    v_min = np.zeros(len(hsv_ranges), dtype=np.uint8)
+    
+    for bit, ranges in enumerate(hsv_ranges.values()):
+        for lower, upper in zip(ranges[::2], ranges[1::2]):
+            hue_bits[lower[0]:min(upper[0], 179) + 1] |= 1 << bit
+        
+        s_min[bit] = ranges[0][1]
+        v_min[bit] = ranges[0][2]
+    
+    return hue_bits, s_min, v_min
+
+
+def _build_bgr_lookup(hsv_ranges: Dict) -> np.ndarray:
+    """
+    Precompute the color bitmask of every quantized BGR value
+    
+    Each (B>>3, G>>3, R>>3) bin is converted to HSV once at its center and
+    classified against the hue table and S/V minimums, so labelling an
+    image needs no per-image color-space conversion - just one gather.
+    
+    Args:
+        hsv_ranges: Mapping of color name to [lower, upper, ...] HSV tuples
+        
+    Returns:
+        uint8 array of 32**3 color bitmasks indexed by (b>>3)<<10 | (g>>3)<<5 | (r>>3)
+    """
+    hue_bits, s_min, v_min = _build_hsv_lookup(hsv_ranges)
+    
+    centers = np.arange(32, dtype=np.uint8) * 8 + 4
+    b, g, r = np.meshgrid(centers, centers, centers, indexing='ij')
+    bins = np.stack([b, g, r], axis=-1).reshape(-1, 1, 3)
+    hsv = cv2.cvtColor(bins, cv2.COLOR_BGR2HSV).reshape(-1, 3)
+    
+    candidates = hue_bits[hsv[:, 0]]
+    bits = np.zeros(len(hsv), dtype=np.uint8)
+    
+    # Keep each hue match only where it meets that color's saturation/value minimum
+    for bit in range(len(s_min)):
+        strong = (hsv[:, 1] >= s_min[bit]) & (hsv[:, 2] >= v_min[bit])
+        bits |= candidates & np.uint8(1 << bit) & -strong.view(np.uint8)
+    
+    return bits
+
+
+def _encoded_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Read (width, height) from a JPEG or PNG header without decoding it
+    
+    Returns None for other formats or if no frame header is found.
+    
+    This is the canonical marker parser; jpeg_size() in
+    scripts/color_spectrum_service.py mirrors the JPEG branch for the
+    standalone color service, so change both together.
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        # IHDR is always the first chunk
+        if data[12:16] != b'IHDR':
+            return None
+        return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+    
+    if data[:2] != b'\xff\xd8':
+        return None
+    
+    pos = 2
+    while pos + 9 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        
+        if marker == 0xFF:  # Fill byte
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # Standalone, no length
+            pos += 2
+            continue
+        
+        # SOF0-SOF15, excluding DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[pos + 5:pos + 7], 'big')
+            width = int.from_bytes(data[pos + 7:pos + 9], 'big')
+            return width, height
+        
+        pos += 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+    
+    return None
+
+
+def _corner_windows(width: int, height: int) -> Dict[str, Tuple[int, int, int, int]]:
+    """Black corner regions (x, y, w, h), each 10% of the image size"""
+    corner_size_w = width // 10
+    corner_size_h = height // 10
+    
+    return {
+        'top_left': (0, 0, corner_size_w, corner_size_h),
+        'top_right': (width - corner_size_w, 0, corner_size_w, corner_size_h),
+        'bottom_left': (0, height - corner_size_h, corner_size_w, corner_size_h),
+        'bottom_right': (width - corner_size_w, height - corner_size_h, corner_size_w, corner_size_h)
+    }
+
+
+@lru_cache(maxsize=64)
+def _polyfit_solver(wavelengths: Tuple[int, ...], deg: int) -> np.ndarray:
+    """
+    Least-squares polynomial fit operator for a fixed set of sample points
+    
+    Mirrors np.polyfit - Vandermonde columns are scaled to unit norm before
+    the SVD-based pseudoinverse and the same rcond is used - but is computed
+    once per wavelength set. Fitting is then a single matrix product.
+    
+    Args:
+        wavelengths: Sample x values
+        deg: Polynomial degree
+        
+    Returns:
+        Read-only (deg+1, N) array; solver @ y gives coefficients, highest power first
+    """
+    x = np.asarray(wavelengths, dtype=np.float64)
+    vander = np.vander(x, deg + 1)
+    column_scale = np.sqrt((vander * vander).sum(axis=0))
+    
+    solver = np.linalg.pinv(vander / column_scale, len(x) * np.finfo(x.dtype).eps)
+    solver /= column_scale[:, np.newaxis]
+    solver.setflags(write=False)
+    
+    return solver
+
+
+if njit is not None:
+    # An explicit signature compiles (or loads from cache) at import instead
+    # of on the first frame, and skips per-call type dispatch. Callers pass
+    # C-contiguous uint8 arrays; bounds checks stay off (numba's default).
+    # Serial on purpose: the server calls this from many request threads,
+    # which numba's workqueue threading layer aborts on, and a parallel
+    # region run before fork() kills GNU OpenMP children. The LUT gather is
+    # memory-bound, and the request pool already spreads work over cores.
+    @njit('uint8[:, ::1](uint8[:, :, ::1], uint8[::1])',
+          cache=True, fastmath=True, boundscheck=False)
+    def _classify_bgr_kernel(image, bgr_lut):
+        """Map each BGR pixel to its color bitmask in a single pass"""
+        height, width = image.shape[0], image.shape[1]
+        bits = np.empty((height, width), dtype=np.uint8)
+        
+        for y in range(height):
+            for x in range(width):
+                index = ((image[y, x, 0] >> 3) << 10) | ((image[y, x, 1] >> 3) << 5) | (image[y, x, 2] >> 3)
+                bits[y, x] = bgr_lut[index]
+        
+        return bits
+else:
+    _classify_bgr_kernel = None
+
 
 class SpectralProcessor:
     """
@@ -39,6 +257,18 @@ class SpectralProcessor:
         'magenta': 570
     }
     
+    # Ideal normalized (R, G, B) reference response per wavelength. Each
+    # channel is 1.0 at its peak and proportional elsewhere based on spectral
+    # overlap: red peaks at red/yellow, green at green, blue at blue/cyan.
+    DEFAULT_REFERENCE = {
+        460: (0.2, 0.3, 1.0),  # Blue
+        490: (0.1, 0.6, 1.0),  # Cyan
+        530: (0.3, 1.0, 0.4),  # Green
+        570: (0.3, 0.6, 0.3),  # Magenta
+        580: (1.0, 0.6, 0.3),  # Yellow
+        625: (1.0, 0.2, 0.1)   # Red
+    }
+    
     # HSV ranges for color detection (H: 0-179, S: 0-255, V: 0-255)
     HSV_RANGES = {
         'red': [(0, 100, 100), (10, 255, 255), (170, 100, 100), (180, 255, 255)],  # Red wraps around
@@ -49,48 +279,198 @@ class SpectralProcessor:
         'magenta': [(140, 50, 100), (170, 255, 255)]
     }
     
-    def __init__(self, image_data: bytes):
+    # Per-pixel color bitplanes (one bit per color) and their quantized BGR lookup table
+    COLOR_BITS = {name: 1 << bit for bit, name in enumerate(HSV_RANGES)}
+    _BGR_LUT = _build_bgr_lookup(HSV_RANGES)
+    
+    # Color regions are averages over large areas, so images are decoded at
+    # 1/DECODE_REDUCTION size (libjpeg scales during the DCT, never
+    # materializing the full frame). Reported positions/areas stay full-res.
+    DECODE_REDUCTION = 2
+    _DECODE_FLAGS = {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8
+    }
+    
+    # Pixels per row strip in the NumPy classification fallback (~384KB of
+    # BGR input, uint16 index and output - sized to stay within L2)
+    CLASSIFY_STRIP_PIXELS = 1 << 16
+    
+    # Minimum color region size in full-resolution pixels
+    MIN_REGION_AREA = 100
+    
+    # Structuring element for mask cleanup (all-ones, so OpenCV runs it separably)
+    _MORPH_KERNEL = np.ones((5, 5), np.uint8)
+    
+    # Decoded frames below this many pixels extract colors sequentially
+    PARALLEL_MIN_PIXELS = 1_000_000
+    
+    def __init__(self, image_data: Union[bytes, np.ndarray]):
         """
         Initialize processor with image data
         
         Args:
-            image_data: Raw image bytes
+            image_data: Encoded image bytes, or an already-decoded BGR uint8
+                        array (processed as-is at full resolution)
         """
         self.image_data = image_data
         self.image = None
-        self.hsv_image = None
+        self.color_bits = None
         self.height = 0
         self.width = 0
-        self.color_regions = {}
-        self.black_regions = {}
-        self.raw_intensities = {}
-        self.corrected_intensities = {}
+        self.scale = 1
+        self._baseline = None
         self.correction_curves = {}
         self.calibration_data = {}
         
+        # Detected color regions as parallel arrays, one row per region
+        self._region_names = []
+        self._wavelengths = np.empty(0, dtype=np.int64)
+        self._rgb = np.empty((0, 3), dtype=np.int64)  # R, G, B
+        self._centers = np.empty((0, 2), dtype=np.int64)  # x, y
+        self._bboxes = np.empty((0, 4), dtype=np.int64)  # x, y, width, height
+        self._areas = np.empty(0, dtype=np.int64)
+        self._corrected_rgb = np.empty((0, 3), dtype=np.float64)
+        
+        # Black corner samples as parallel arrays, one row per corner
+        self._corner_names = []
+        self._black_rgb = np.empty((0, 3), dtype=np.float64)  # R, G, B
+        self._corner_positions = np.empty((0, 4), dtype=np.int64)  # x, y, width, height
+    
+    @property
+    def color_regions(self) -> Dict:
+        """Detected color regions keyed by color name (JSON layout)"""
+        return {
+            name: {
+                'wavelength': wavelength,
+                'rgb': {'r': r, 'g': g, 'b': b},
+                'bgr': {'b': b, 'g': g, 'r': r},
+                'center': {'x': cx, 'y': cy},
+                'area': area,
+                'bbox': {'x': x, 'y': y, 'width': w, 'height': h}
+            }
+            for name, wavelength, (r, g, b), (cx, cy), area, (x, y, w, h) in zip(
+                self._region_names, self._wavelengths.tolist(), self._rgb.tolist(),
+                self._centers.tolist(), self._areas.tolist(), self._bboxes.tolist())
+        }
+    
+    @property
+    def raw_intensities(self) -> Dict:
+        """Raw region intensities keyed by wavelength"""
+        return {
+            wavelength: {'r': r, 'g': g, 'b': b, 'color': name}
+            for name, wavelength, (r, g, b) in zip(
+                self._region_names, self._wavelengths.tolist(), self._rgb.tolist())
+        }
+    
+    @property
+    def corrected_intensities(self) -> Dict:
+        """Shadow-corrected region intensities keyed by wavelength"""
+        return {
+            wavelength: {'r': r, 'g': g, 'b': b, 'color': name}
+            for name, wavelength, (r, g, b) in zip(
+                self._region_names, self._wavelengths.tolist(), self._corrected_rgb.tolist())
+        }
+    
+    @property
+    def black_regions(self) -> Dict:
+        """Black corner samples keyed by corner name (JSON layout)"""
+        return {
+            name: {
+                'rgb': {'r': r, 'g': g, 'b': b},
+                'bgr': {'b': b, 'g': g, 'r': r},
+                'position': {'x': x, 'y': y, 'width': w, 'height': h}
+            }
+            for name, (r, g, b), (x, y, w, h) in zip(
+                self._corner_names, self._black_rgb.tolist(), self._corner_positions.tolist())
+        }
+    
+    @classmethod
+    def warm(cls) -> None:
+        """
+        Pay one-time setup costs up front instead of on the first request
+        
+        Compiles (or loads from cache) the numba classification kernel and
+        primes the polynomial fit operator for the full wavelength set.
+        Mask buffers are thread-local, so each worker thread still allocates
+        its own on first use. Processors hold per-image state, so callers
+        should still create one per request.
+        """
+        frame = np.zeros((64, 64, 3), dtype=np.uint8)
+        cls(frame)._classify_pixels(frame)
+        
+        _polyfit_solver(tuple(sorted(cls.COLOR_WAVELENGTHS.values())), 3)
+        
     def load_image(self) -> bool:
         """Load and preprocess image"""
         try:
-            # Decode image
-            nparr = np.frombuffer(self.image_data, np.uint8)
-            self.image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            size = None
+            if isinstance(self.image_data, np.ndarray):
+                # Caller already decoded the frame - nothing to reduce
+                self.image = self.image_data
+                self.scale = 1
+            else:
+                # Reduce only when the header gives the true full-resolution
+                # size - reduced dimensions are rounded (JPEG up, PNG down)
+                size = _encoded_size(self.image_data)
+                self.scale = self.DECODE_REDUCTION if size is not None else 1
+                nparr = np.frombuffer(self.image_data, np.uint8)
+                self.image = cv2.imdecode(nparr, self._DECODE_FLAGS[self.scale])
             
             if self.image is None:
-                print("ERROR: Failed to decode image", file=sys.stderr)
+                logger.error("Failed to decode image")
                 return False
             
-            self.height, self.width = self.image.shape[:2]
-            print(f"Loaded image: {self.width}x{self.height}", file=sys.stderr)
+            # Full-resolution size, as reported in results
+            decoded_h, decoded_w = self.image.shape[:2]
+            if size is None:
+                self.width, self.height = decoded_w, decoded_h
+            else:
+                self.width, self.height = size
+                # imdecode applies EXIF orientation - follow it if the frame was turned
+                if (abs(self.height - decoded_w * self.scale) + abs(self.width - decoded_h * self.scale) <
+                        abs(self.width - decoded_w * self.scale) + abs(self.height - decoded_h * self.scale)):
+                    self.width, self.height = self.height, self.width
+            logger.info("Loaded image: %dx%d (processing at 1/%d)", self.width, self.height, self.scale)
             
-            # Convert to HSV for color detection
-            self.hsv_image = cv2.cvtColor(self.image, cv2.COLOR_BGR2HSV)
+            # Classify pixels against the HSV ranges via the BGR lookup table
+            self.color_bits = self._classify_pixels(self.image)
             
             return True
             
         except Exception as e:
-            print(f"ERROR loading image: {e}", file=sys.stderr)
+            logger.error("Error loading image: %s", e)
             return False
     
+    def _classify_pixels(self, image: np.ndarray) -> np.ndarray:
+        """
+        Tag every pixel with its color bitmask in a single pass over the BGR image
+        
+        Args:
+            image: BGR image
+            
+        Returns:
+            uint8 image with bit i set where color i's HSV range matches
+        """
+        if _classify_bgr_kernel is not None:
+            return _classify_bgr_kernel(np.ascontiguousarray(image), self._BGR_LUT)
+        
+        # Without numba, work in row strips so the index temporaries stay
+        # cache-resident instead of streaming whole-frame arrays from DRAM
+        bits = np.empty(image.shape[:2], dtype=np.uint8)
+        rows = max(1, self.CLASSIFY_STRIP_PIXELS // image.shape[1])
+        
+        for y in range(0, image.shape[0], rows):
+            strip = image[y:y+rows]
+            index = (strip[..., 0] >> 3).astype(np.uint16) << 10
+            index |= (strip[..., 1] >> 3).astype(np.uint16) << 5
+            index |= strip[..., 2] >> 3
+            np.take(self._BGR_LUT, index, out=bits[y:y+rows])
+        
+        return bits
+    
     def extract_color_regions(self) -> bool:
         """
         Extract 6 color regions using HSV thresholding
@@ -98,85 +478,127 @@ class SpectralProcessor:
         Returns:
             True if at least 4 colors found, False otherwise
         """
-        print("Extracting color regions via HSV thresholding...", file=sys.stderr)
+        logger.debug("Extracting color regions via HSV thresholding...")
         
-        for color_name, wavelength in self.COLOR_WAVELENGTHS.items():
-            mask = self._create_color_mask(color_name)
-            
-            if mask is None or cv2.countNonZero(mask) < 100:
-                print(f"WARNING: {color_name} region not found or too small", file=sys.stderr)
-                continue
-            
-            # Find largest contour for this color
-            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            if not contours:
-                continue
-            
-            # Get largest contour
-            largest_contour = max(contours, key=cv2.contourArea)
-            area = cv2.contourArea(largest_contour)
-            
-            if area < 100:  # Minimum area threshold
+        # Work in decoded pixels; scale back to full resolution when storing
+        min_area = self.MIN_REGION_AREA / (self.scale * self.scale)
+        color_names = list(self.COLOR_WAVELENGTHS)
+        
+        # OpenCV releases the GIL, so colors can be extracted concurrently -
+        # but only once the frame is large enough to outweigh the dispatch
+        if self.image.shape[0] * self.image.shape[1] >= self.PARALLEL_MIN_PIXELS:
+            results = list(_get_color_pool().map(
+                lambda name: self._extract_region(name, min_area), color_names))
+        else:
+            results = [self._extract_region(name, min_area) for name in color_names]
+        
+        names, wavelengths, rgb, centers, bboxes, areas = [], [], [], [], [], []
+        
+        for color_name, region in zip(color_names, results):
+            if region is None:
+                logger.debug("%s region not found or too small", color_name)
                 continue
             
-            # Get bounding box and center
-            x, y, w, h = cv2.boundingRect(largest_contour)
-            center_x = x + w // 2
-            center_y = y + h // 2
-            
-            # Extract average RGB from this region
-            region_mask = np.zeros(self.image.shape[:2], dtype=np.uint8)
-            cv2.drawContours(region_mask, [largest_contour], -1, 255, -1)
+            region_rgb, center, bbox, area = region
             
-            avg_color = cv2.mean(self.image, mask=region_mask)[:3]  # BGR
-            b, g, r = avg_color
+            names.append(color_name)
+            wavelengths.append(self.COLOR_WAVELENGTHS[color_name])
+            rgb.append(region_rgb)
+            centers.append(center)
+            bboxes.append(bbox)
+            areas.append(area)
             
-            self.color_regions[color_name] = {
-                'wavelength': wavelength,
-                'rgb': {'r': int(r), 'g': int(g), 'b': int(b)},
-                'bgr': {'b': int(b), 'g': int(g), 'r': int(r)},
-                'center': {'x': center_x, 'y': center_y},
-                'area': int(area),
-                'bbox': {'x': x, 'y': y, 'width': w, 'height': h}
-            }
-            
-            print(f"Found {color_name}: RGB({int(r)}, {int(g)}, {int(b)}) at ({center_x}, {center_y})", file=sys.stderr)
+            logger.debug("Found %s: RGB(%d, %d, %d) at (%d, %d)", color_name, *region_rgb, *center)
         
-        num_colors = len(self.color_regions)
-        print(f"Extracted {num_colors}/6 color regions", file=sys.stderr)
+        self._region_names = names
+        self._wavelengths = np.array(wavelengths, dtype=np.int64)
+        self._rgb = np.array(rgb, dtype=np.int64).reshape(-1, 3)
+        self._centers = np.array(centers, dtype=np.int64).reshape(-1, 2)
+        self._bboxes = np.array(bboxes, dtype=np.int64).reshape(-1, 4)
+        self._areas = np.array(areas, dtype=np.int64)
+        
+        num_colors = len(self._region_names)
+        logger.info("Extracted %d/6 color regions", num_colors)
         
         return num_colors >= 4  # Need at least 4 colors for calibration
     
-    def _create_color_mask(self, color_name: str) -> Optional[np.ndarray]:
+    def _extract_region(self, color_name: str, min_area: float) -> Optional[Tuple]:
         """
-        Create binary mask for specified color using HSV ranges
+        Locate the largest region of one color and measure its average RGB
+        
+        Safe to run concurrently for different colors: it only reads the
+        shared image/bitplane arrays and allocates its own masks.
         
         Args:
             color_name: Name of color to extract
+            min_area: Minimum contour area in decoded pixels
             
         Returns:
-            Binary mask or None if color not defined
+            Tuple of ((r, g, b), (cx, cy), (x, y, w, h), area) in full-resolution
+            coordinates, or None if the color is absent or too small
         """
-        if color_name not in self.HSV_RANGES:
+        mask = self._create_color_mask(color_name, min_pixels=min_area)
+        
+        if mask is None:
             return None
         
-        ranges = self.HSV_RANGES[color_name]
+        # Find largest contour for this color
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
-        # Handle red which wraps around hue circle
-        if color_name == 'red':
-            lower1, upper1, lower2, upper2 = ranges
-            mask1 = cv2.inRange(self.hsv_image, np.array(lower1), np.array(upper1))
-            mask2 = cv2.inRange(self.hsv_image, np.array(lower2), np.array(upper2))
-            mask = cv2.bitwise_or(mask1, mask2)
-        else:
-            lower, upper = ranges
-            mask = cv2.inRange(self.hsv_image, np.array(lower), np.array(upper))
+        if not contours:
+            return None
+        
+        # Get largest contour
+        largest_contour = max(contours, key=cv2.contourArea)
+        area = cv2.contourArea(largest_contour)
+        
+        if area < min_area:  # Minimum area threshold
+            return None
+        
+        # Get bounding box and center
+        x, y, w, h = cv2.boundingRect(largest_contour)
+        
+        # Extract average RGB from this region, rasterizing the contour
+        # into a bbox-sized mask instead of a full-frame one
+        region_mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.drawContours(region_mask, [largest_contour], -1, 255, -1, offset=(-x, -y))
         
-        # Morphological operations to clean up mask
-        kernel = np.ones((5, 5), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        b, g, r = cv2.mean(self.image[y:y+h, x:x+w], mask=region_mask)[:3]  # BGR
+        
+        scale = self.scale
+        x, y, w, h = x * scale, y * scale, w * scale, h * scale
+        
+        return ((int(r), int(g), int(b)), (x + w // 2, y + h // 2),
+                (x, y, w, h), int(area * scale * scale))
+    
+    def _create_color_mask(self, color_name: str, min_pixels: float = 0) -> Optional[np.ndarray]:
+        """
+        Create binary mask for specified color from the per-pixel color bitplanes
+        
+        Args:
+            color_name: Name of color to extract
+            min_pixels: Return None without cleaning up the mask when fewer
+                        pixels than this carry the color
+            
+        Returns:
+            Binary mask or None if color not defined or too sparse. The mask
+            is this thread's scratch buffer, valid until its next call.
+        """
+        if color_name not in self.COLOR_BITS:
+            return None
+        
+        # Nonzero (= the color's bit) where the pixel carries this color;
+        # countNonZero, morphology and findContours need no 0/255 rescale
+        mask = _scratch_mask(*self.color_bits.shape)
+        np.bitwise_and(self.color_bits, np.uint8(self.COLOR_BITS[color_name]), out=mask)
+        
+        if cv2.countNonZero(mask) < min_pixels:
+            return None
+        
+        # Close small gaps so a region stays one contour. No opening pass:
+        # isolated specks form their own tiny contours, which the largest-
+        # contour pick and the minimum area check already discard.
+        cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self._MORPH_KERNEL, dst=mask)
         
         return mask
     
@@ -187,33 +609,27 @@ class SpectralProcessor:
         Returns:
             True if corners extracted successfully
         """
-        print("Extracting black corner regions...", file=sys.stderr)
+        logger.debug("Extracting black corner regions...")
         
-        # Define corner regions (10% of image size)
-        corner_size_w = self.width // 10
-        corner_size_h = self.height // 10
+        self._baseline = None
         
-        corners = {
-            'top_left': (0, 0, corner_size_w, corner_size_h),
-            'top_right': (self.width - corner_size_w, 0, corner_size_w, corner_size_h),
-            'bottom_left': (0, self.height - corner_size_h, corner_size_w, corner_size_h),
-            'bottom_right': (self.width - corner_size_w, self.height - corner_size_h, corner_size_w, corner_size_h)
-        }
+        # Sample in decoded pixels; report the full-resolution windows
+        height, width = self.image.shape[:2]
+        corners = _corner_windows(width, height)
         
-        for corner_name, (x, y, w, h) in corners.items():
-            region = self.image[y:y+h, x:x+w]
-            
-            # Get average RGB
-            avg_color = region.mean(axis=(0, 1))
-            b, g, r = avg_color
-            
-            self.black_regions[corner_name] = {
-                'rgb': {'r': float(r), 'g': float(g), 'b': float(b)},
-                'bgr': {'b': float(b), 'g': float(g), 'r': float(r)},
-                'position': {'x': x, 'y': y, 'width': w, 'height': h}
-            }
+        black_rgb = np.empty((len(corners), 3), dtype=np.float64)
+        
+        for row, (corner_name, (x, y, w, h)) in enumerate(corners.items()):
+            # Average BGR straight from a view of the corner - no slice copy
+            # or float temporary, unlike ndarray.mean over the same window
+            b, g, r = cv2.mean(self.image[y:y+h, x:x+w])[:3]
+            black_rgb[row] = (r, g, b)
             
-            print(f"Black corner {corner_name}: RGB({r:.1f}, {g:.1f}, {b:.1f})", file=sys.stderr)
+            logger.debug("Black corner %s: RGB(%.1f, %.1f, %.1f)", corner_name, r, g, b)
+        
+        self._corner_names = list(corners)
+        self._black_rgb = black_rgb
+        self._corner_positions = np.array(list(_corner_windows(self.width, self.height).values()), dtype=np.int64)
         
         return True
     
@@ -221,21 +637,19 @@ class SpectralProcessor:
         """
         Calculate average baseline (shadow/noise) from black corners
         
+        The result is cached until the black corners are extracted again.
+        
         Returns:
             Tuple of (R_baseline, G_baseline, B_baseline)
         """
-        r_values = [corner['rgb']['r'] for corner in self.black_regions.values()]
-        g_values = [corner['rgb']['g'] for corner in self.black_regions.values()]
-        b_values = [corner['rgb']['b'] for corner in self.black_regions.values()]
+        if self._baseline is not None:
+            return self._baseline
         
-        baseline = (
-            np.mean(r_values),
-            np.mean(g_values),
-            np.mean(b_values)
-        )
+        baseline = tuple(self._black_rgb.mean(axis=0).tolist())
         
-        print(f"Calculated baseline: R={baseline[0]:.2f}, G={baseline[1]:.2f}, B={baseline[2]:.2f}", file=sys.stderr)
+        logger.debug("Calculated baseline: R=%.2f, G=%.2f, B=%.2f", *baseline)
         
+        self._baseline = baseline
         return baseline
     
     def perform_shadow_correction(self) -> Dict:
@@ -245,36 +659,18 @@ class SpectralProcessor:
         Returns:
             Dictionary with corrected intensities
         """
-        print("Performing shadow correction...", file=sys.stderr)
+        logger.debug("Performing shadow correction...")
         
-        r_baseline, g_baseline, b_baseline = self.calculate_baseline()
+        baseline = np.array(self.calculate_baseline(), dtype=np.float64)
         
-        # Extract raw intensities
-        for color_name, region in self.color_regions.items():
-            wavelength = region['wavelength']
-            rgb = region['rgb']
-            
-            # Store raw intensities
-            self.raw_intensities[wavelength] = {
-                'r': rgb['r'],
-                'g': rgb['g'],
-                'b': rgb['b'],
-                'color': color_name
-            }
-            
-            # Apply baseline subtraction
-            corrected = {
-                'r': max(0, rgb['r'] - r_baseline),
-                'g': max(0, rgb['g'] - g_baseline),
-                'b': max(0, rgb['b'] - b_baseline),
-                'color': color_name
-            }
-            
-            self.corrected_intensities[wavelength] = corrected
-            
-            print(f"{color_name} ({wavelength}nm): Raw=({rgb['r']}, {rgb['g']}, {rgb['b']}) -> "
-                  f"Corrected=({corrected['r']:.1f}, {corrected['g']:.1f}, {corrected['b']:.1f})", 
-                  file=sys.stderr)
+        # Apply baseline subtraction to all regions at once
+        self._corrected_rgb = np.maximum(0, self._rgb - baseline)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            for color_name, wavelength, raw, corrected in zip(self._region_names, self._wavelengths,
+                                                              self._rgb, self._corrected_rgb):
+                logger.debug("%s (%dnm): Raw=(%d, %d, %d) -> Corrected=(%.1f, %.1f, %.1f)",
+                             color_name, wavelength, *raw, *corrected)
         
         return self.corrected_intensities
     
@@ -291,115 +687,62 @@ class SpectralProcessor:
         Returns:
             Dictionary with correction curve parameters and corrected values
         """
-        print("Fitting correction curves with reference values...", file=sys.stderr)
+        logger.debug("Fitting correction curves with reference values...")
         
-        if not self.corrected_intensities:
+        if not len(self._corrected_rgb):
             raise ValueError("Must perform shadow correction first")
         
         # Sort by wavelength
-        wavelengths = sorted(self.corrected_intensities.keys())
+        order = np.argsort(self._wavelengths)
+        wavelengths = self._wavelengths[order].tolist()
         
-        # Extract shadow-corrected intensities (baseline already subtracted)
-        r_intensities = [self.corrected_intensities[wl]['r'] for wl in wavelengths]
-        g_intensities = [self.corrected_intensities[wl]['g'] for wl in wavelengths]
-        b_intensities = [self.corrected_intensities[wl]['b'] for wl in wavelengths]
+        # Shadow-corrected intensities (baseline already subtracted) as a (3, N) array
+        intensities = self._corrected_rgb[order].T
         
         # Define reference values based on expected spectral response
         # For a calibrated camera, each color should show strong response at its wavelength
         if reference_data:
             # Use provided reference data
-            print("Using provided reference data", file=sys.stderr)
+            logger.debug("Using provided reference data")
         else:
-            # Generate ideal reference values
-            # Each color should have normalized response of 1.0 at its peak wavelength
-            # and proportional response at other wavelengths based on spectral overlap
-            reference_data = {}
-            for wl in wavelengths:
-                # Red channel: peaks at red (625nm), weak at blue/cyan
-                if wl >= 580:  # Yellow, Red
-                    r_ref = 1.0
-                elif wl >= 530:  # Green
-                    r_ref = 0.3
-                elif wl >= 490:  # Cyan
-                    r_ref = 0.1
-                else:  # Blue, Magenta
-                    r_ref = 0.2
-                
-                # Green channel: peaks at green (530nm), moderate at yellow/cyan
-                if wl == 530:  # Green
-                    g_ref = 1.0
-                elif wl in [490, 570, 580]:  # Cyan, Magenta, Yellow
-                    g_ref = 0.6
-                elif wl == 625:  # Red
-                    g_ref = 0.2
-                else:  # Blue
-                    g_ref = 0.3
-                
-                # Blue channel: peaks at blue/cyan (460-490nm), weak at red
-                if wl <= 490:  # Blue, Cyan
-                    b_ref = 1.0
-                elif wl == 530:  # Green
-                    b_ref = 0.4
-                elif wl in [570, 580]:  # Magenta, Yellow
-                    b_ref = 0.3
-                else:  # Red
-                    b_ref = 0.1
-                
-                reference_data[wl] = {'r': r_ref, 'g': g_ref, 'b': b_ref}
-                print(f"Reference for {wl}nm: R={r_ref}, G={g_ref}, B={b_ref}", file=sys.stderr)
+            # Use the ideal reference table
+            reference_data = {
+                wl: dict(zip('rgb', self.DEFAULT_REFERENCE.get(wl, (1.0, 1.0, 1.0))))
+                for wl in wavelengths
+            }
         
         # Normalize raw intensities to 0-1 range for comparison with reference
-        max_r = max(r_intensities) if max(r_intensities) > 0 else 1
-        max_g = max(g_intensities) if max(g_intensities) > 0 else 1
-        max_b = max(b_intensities) if max(b_intensities) > 0 else 1
-        
-        r_normalized = [r / max_r for r in r_intensities]
-        g_normalized = [g / max_g for g in g_intensities]
-        b_normalized = [b / max_b for b in b_intensities]
+        channel_max = intensities.max(axis=1, keepdims=True)
+        normalized = intensities / np.where(channel_max > 0, channel_max, 1)
         
         # Calculate correction factors: Correction = Reference / Normalized_Measured
         # This compares reference (0-1) with normalized raw (0-1)
         MIN_THRESHOLD = 0.01  # Minimum normalized intensity
         
-        r_corrections = []
-        g_corrections = []
-        b_corrections = []
+        default_ref = {'r': 1.0, 'g': 1.0, 'b': 1.0}
+        reference = np.array([[reference_data.get(wl, default_ref)[c] for wl in wavelengths] for c in 'rgb'],
+                             dtype=np.float64)
         
-        for wl, r_norm, g_norm, b_norm in zip(wavelengths, r_normalized, g_normalized, b_normalized):
-            ref = reference_data.get(wl, {'r': 1.0, 'g': 1.0, 'b': 1.0})
-            
-            # Correction_Factor = Reference / Normalized_Measured
-            r_corr = ref['r'] / max(r_norm, MIN_THRESHOLD)
-            g_corr = ref['g'] / max(g_norm, MIN_THRESHOLD)
-            b_corr = ref['b'] / max(b_norm, MIN_THRESHOLD)
-            
-            # Clip to reasonable range to avoid extreme corrections
-            r_corr = max(0.1, min(10.0, r_corr))
-            g_corr = max(0.1, min(10.0, g_corr))
-            b_corr = max(0.1, min(10.0, b_corr))
-            
-            r_corrections.append(r_corr)
-            g_corrections.append(g_corr)
-            b_corrections.append(b_corr)
-            
-            print(f"{wl}nm: Normalized=({r_norm:.2f},{g_norm:.2f},{b_norm:.2f}) Ref=({ref['r']:.2f},{ref['g']:.2f},{ref['b']:.2f}) -> "
-                  f"Corrections=({r_corr:.2f},{g_corr:.2f},{b_corr:.2f})", file=sys.stderr)
+        # Correction_Factor = Reference / Normalized_Measured,
+        # clipped to reasonable range to avoid extreme corrections
+        corrections = np.clip(reference / np.maximum(normalized, MIN_THRESHOLD), 0.1, 10.0)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, wl in enumerate(wavelengths):
+                logger.debug("%dnm: Normalized=(%.2f,%.2f,%.2f) Ref=(%.2f,%.2f,%.2f) -> Corrections=(%.2f,%.2f,%.2f)",
+                             wl, *normalized[:, i], *reference[:, i], *corrections[:, i])
         
         # Calculate final corrected values: Corrected = Normalized × Correction_Factor
-        r_corrected_final = [r * c for r, c in zip(r_normalized, r_corrections)]
-        g_corrected_final = [g * c for g, c in zip(g_normalized, g_corrections)]
-        b_corrected_final = [b * c for b, c in zip(b_normalized, b_corrections)]
+        corrected_final = normalized * corrections
+        
+        r_normalized, g_normalized, b_normalized = normalized.tolist()
+        r_corrections, g_corrections, b_corrections = corrections.tolist()
+        r_corrected_final, g_corrected_final, b_corrected_final = corrected_final.tolist()
         
-        # Fit polynomial curves (degree 3)
+        # Fit polynomial curves (degree 3) for all channels with the cached
+        # least-squares operator for this wavelength set
         try:
-            r_poly = np.polyfit(wavelengths, r_corrections, deg=3)
-            g_poly = np.polyfit(wavelengths, g_corrections, deg=3)
-            b_poly = np.polyfit(wavelengths, b_corrections, deg=3)
-            
-            # Also fit splines for smoother interpolation
-            r_spline = UnivariateSpline(wavelengths, r_corrections, s=0.1, k=3)
-            g_spline = UnivariateSpline(wavelengths, g_corrections, s=0.1, k=3)
-            b_spline = UnivariateSpline(wavelengths, b_corrections, s=0.1, k=3)
+            r_poly, g_poly, b_poly = (_polyfit_solver(tuple(wavelengths), 3) @ corrections.T).T
             
             self.correction_curves = {
                 'polynomial': {
@@ -428,11 +771,12 @@ class SpectralProcessor:
                 'reference_values': reference_data
             }
             
-            print(f"✅ Fitted correction curves for {len(wavelengths)} wavelength points", file=sys.stderr)
-            print(f"Final corrected values - R: {r_corrected_final}, G: {g_corrected_final}, B: {b_corrected_final}", file=sys.stderr)
+            logger.info("Fitted correction curves for %d wavelength points", len(wavelengths))
+            logger.debug("Final corrected values - R: %s, G: %s, B: %s",
+                         r_corrected_final, g_corrected_final, b_corrected_final)
             
         except Exception as e:
-            print(f"ERROR fitting curves: {e}", file=sys.stderr)
+            logger.error("Error fitting curves: %s", e)
             raise
         
         return self.correction_curves
@@ -475,10 +819,16 @@ class SpectralProcessor:
             'baseline': self.calculate_baseline()
         }
         
-        with open(filename, 'w') as f:
-            json.dump(calibration, f, indent=2)
+        if orjson is not None:
+            options = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+            with open(filename, 'wb') as f:
+                f.write(orjson.dumps(calibration, option=options))
+        else:
+            # Encode in one call and write once; json.dump issues a write per chunk
+            with open(filename, 'w') as f:
+                f.write(json.dumps(calibration, indent=2))
         
-        print(f"Calibration data saved to {filename}", file=sys.stderr)
+        logger.info("Calibration data saved to %s", filename)
     
     def process(self, force_analysis: bool = False) -> Dict:
         """
@@ -496,31 +846,32 @@ class SpectralProcessor:
         
         # Extract color regions
         has_enough_colors = self.extract_color_regions()
+        num_colors = len(self._region_names)
         
         # If force_analysis is True, always use analysis mode regardless of color count
-        if force_analysis and len(self.color_regions) > 0:
-            print(f"🔍 Force analysis mode: returning {len(self.color_regions)} color(s) for analysis", file=sys.stderr)
+        if force_analysis and num_colors > 0:
+            logger.info("Force analysis mode: returning %d color(s) for analysis", num_colors)
             return {
                 'success': True,
                 'mode': 'analysis_only',
                 'color_regions': self.color_regions,
-                'num_colors_detected': len(self.color_regions),
-                'message': f'Analysis mode: detected {len(self.color_regions)} color region(s)'
+                'num_colors_detected': num_colors,
+                'message': f'Analysis mode: detected {num_colors} color region(s)'
             }
         
         # If we have at least 1 color but less than 4, return analysis_only mode
         if not has_enough_colors:
-            if len(self.color_regions) > 0:
-                print(f"⚠️ Only {len(self.color_regions)} color(s) detected - returning for analysis only", file=sys.stderr)
+            if num_colors > 0:
+                logger.info("Only %d color(s) detected - returning for analysis only", num_colors)
                 return {
                     'success': True,
                     'mode': 'analysis_only',
                     'color_regions': self.color_regions,
-                    'num_colors_detected': len(self.color_regions),
-                    'message': f'Detected {len(self.color_regions)} color region(s) - insufficient for calibration but available for analysis'
+                    'num_colors_detected': num_colors,
+                    'message': f'Detected {num_colors} color region(s) - insufficient for calibration but available for analysis'
                 }
             else:
-                print("⚠️ No distinct colors found in image", file=sys.stderr)
+                logger.warning("No distinct colors found in image")
                 return {
                     'success': False, 
                     'error': 'No distinct colors detected. This system looks for red, yellow, green, cyan, blue, or magenta colors. Try taking a photo of a colorful object like a phone case, book cover, or printed color chart.'
@@ -541,6 +892,7 @@ class SpectralProcessor:
             return {'success': False, 'error': f'Failed to fit correction curves: {str(e)}'}
         
         # Build result
+        r_baseline, g_baseline, b_baseline = self.calculate_baseline()
         result = {
             'success': True,
             'timestamp': datetime.now().isoformat(),
@@ -551,44 +903,23 @@ class SpectralProcessor:
             'color_regions': self.color_regions,
             'black_corners': self.black_regions,
             'baseline': {
-                'r': float(self.calculate_baseline()[0]),
-                'g': float(self.calculate_baseline()[1]),
-                'b': float(self.calculate_baseline()[2])
+                'r': float(r_baseline),
+                'g': float(g_baseline),
+                'b': float(b_baseline)
             },
             'raw_intensities': {str(k): v for k, v in self.raw_intensities.items()},
             'corrected_intensities': {str(k): v for k, v in self.corrected_intensities.items()},
             'correction_curves': self.correction_curves,
             'statistics': {
-                'num_colors_detected': len(self.color_regions),
-                'num_black_corners': len(self.black_regions),
+                'num_colors_detected': num_colors,
+                'num_black_corners': len(self._corner_names),
                 'wavelength_range': [
-                    min(self.corrected_intensities.keys()),
-                    max(self.corrected_intensities.keys())
-                ] if self.corrected_intensities else [0, 0]
+                    int(self._wavelengths.min()),
+                    int(self._wavelengths.max())
+                ] if len(self._corrected_rgb) else [0, 0]
             }
         }
         
-        # Convert numpy types to native Python types
-        result = self.convert_to_json_serializable(result)
-        
-        print(f"✅ Advanced calibration complete: {len(self.color_regions)} colors, baseline correction applied", 
-              file=sys.stderr)
+        logger.info("Advanced calibration complete: %d colors, baseline correction applied", num_colors)
         
         return result
-    
-    @staticmethod
-    def convert_to_json_serializable(obj):
-        """Convert NumPy types to native Python types for JSON serialization"""
-        if isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.floating):
-            return float(obj)
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        elif isinstance(obj, dict):
-            return {key: SpectralProcessor.convert_to_json_serializable(value) 
-                    for key, value in obj.items()}
-        elif isinstance(obj, list):
-            return [SpectralProcessor.convert_to_json_serializable(item) 
-                    for item in obj]
-        return obj
@@ -9,31 +9,119 @@ Usage:
     pip install flask flask-cors
     python spectral_server.py
 
+    Serves with waitress when installed, otherwise the threaded Flask
+    server. For a multi-core Linux/macOS host, run it under gunicorn:
+
+    SPECTRAL_MAX_CONCURRENCY=1 \
+    gunicorn --workers $(nproc) --threads 4 --worker-class gthread \
+             --bind 0.0.0.0:5000 spectral_server:app
+
+    Each worker imports and warms the processor itself after the fork
+    (don't add --preload - OpenCV/numba thread pools started in the master
+    are not fork-safe), loading the compiled kernel from numba's on-disk
+    cache. SPECTRAL_MAX_CONCURRENCY=1 keeps the workers from each running
+    a full CPU-count of frames at once.
+
 API Endpoints:
     POST /process - Process RGB circle image
+    POST /process-raw - Process raw image bytes (application/octet-stream)
     GET /health - Health check
 """
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import base64
-import io
-import sys
-import traceback
-import tempfile
+import hashlib
+import logging
 import os
-from pathlib import Path
-import cv2
-import numpy as np
-from PIL import Image
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:  # orjson is optional - responses fall back to jsonify
+    orjson = None
 
 # Import our spectral processor
 from spectral_processor import SpectralProcessor
 
+logger = logging.getLogger(__name__)
+
+# Compile the classification kernel and prime the fit cache at startup, so
+# the first request doesn't pay for them
+SpectralProcessor.warm()
+
+# Handler threads queue work onto a fixed pool sized to the CPU count, so a
+# burst of uploads waits its turn instead of oversubscribing the cores the
+# processor's per-color thread pool already uses. Set
+# SPECTRAL_MAX_CONCURRENCY=1 when running several gunicorn worker processes.
+MAX_CONCURRENCY = int(os.environ.get('SPECTRAL_MAX_CONCURRENCY', 0)) or os.cpu_count() or 1
+processing_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix='spectral-request')
+
+# Results are memoized by a digest of the uploaded bytes, so resubmitting the
+# same photo (repeatability checks, dev loops) skips the decode and analysis.
+# Bounded LRU; SPECTRAL_RESULT_CACHE_SIZE=0 disables it.
+RESULT_CACHE_SIZE = int(os.environ.get('SPECTRAL_RESULT_CACHE_SIZE', 64))
+_result_cache = OrderedDict()
+_result_cache_lock = threading.Lock()
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React Native
 
 
+def json_response(payload: dict):
+    """Serialize a result with orjson when installed, else Flask's jsonify"""
+    if orjson is None:
+        return jsonify(payload)
+    
+    # Results key some dicts by wavelength (int), which jsonify stringifies too
+    body = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return app.response_class(body, mimetype='application/json')
+
+
+def run_processor(image_bytes: bytes, force_analysis: bool = False):
+    """
+    Process encoded image bytes and build the JSON response
+    
+    The bytes are passed straight through - SpectralProcessor decodes them
+    itself, so there is no decode/re-encode round trip. Identical uploads
+    are answered from the result cache.
+    """
+    force_analysis = bool(force_analysis)
+    key = (hashlib.blake2b(image_bytes, digest_size=16).digest(), force_analysis)
+    
+    with _result_cache_lock:
+        result = _result_cache.get(key)
+        if result is not None:
+            _result_cache.move_to_end(key)
+    
+    if result is not None:
+        logger.info("Served %d-byte image from result cache", len(image_bytes))
+        return json_response(result)
+    
+    processor = SpectralProcessor(image_bytes)
+    result = processing_pool.submit(processor.process, force_analysis).result()
+    
+    if processor.image is None:
+        return jsonify({
+            'success': False,
+            'error': 'Failed to decode image'
+        }), 400
+    
+    if RESULT_CACHE_SIZE > 0:
+        with _result_cache_lock:
+            _result_cache[key] = result
+            _result_cache.move_to_end(key)
+            while len(_result_cache) > RESULT_CACHE_SIZE:
+                _result_cache.popitem(last=False)
+    
+    logger.info("Processed %d-byte image: success=%s mode=%s",
+                len(image_bytes), result.get('success'), result.get('mode', 'calibration'))
+    
+    return json_response(result)
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -80,50 +168,63 @@ def process_image():
         image_format = data.get('format', 'jpg')
         force_analysis = data.get('force_analysis', False)  # Force analysis mode (no calibration)
         
-        print(f"Received image (format: {image_format})", file=sys.stderr)
+        logger.debug("Received image (format: %s)", image_format)
+        
+        # Work on bytes from here on: b64decode would otherwise convert the
+        # str itself, and partition avoids split's list of str copies
+        image_base64 = image_base64.encode('ascii')
         
         # Remove data URL prefix if present
-        if ',' in image_base64:
-            image_base64 = image_base64.split(',', 1)[1]
+        _, separator, payload = image_base64.partition(b',')
+        if separator:
+            image_base64 = payload
         
         # Decode base64 to bytes
         image_bytes = base64.b64decode(image_base64)
+        logger.debug("Decoded payload: %d bytes", len(image_bytes))
         
-        # Convert to numpy array
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        return run_processor(image_bytes, force_analysis)
         
-        if image is None:
-            return jsonify({
-                'success': False,
-                'error': 'Failed to decode image'
-            }), 400
+    except Exception as e:
+        logger.exception("Error processing image")
         
-        print(f"Decoded image: {image.shape}", file=sys.stderr)
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'error_type': type(e).__name__
+        }), 500
+
+
+@app.route('/process-raw', methods=['POST'])
+def process_raw():
+    """
+    Process RGB circle image sent as the raw request body
+    
+    Skips base64 entirely: the body is the encoded JPEG/PNG itself, about a
+    quarter smaller on the wire than the /process JSON payload.
+    
+    Request:
+        Content-Type: application/octet-stream
+        Query: ?force_analysis=true (optional)
+    
+    Response: Same as /process endpoint
+    """
+    try:
+        image_bytes = request.get_data(cache=False)
         
-        # Convert image back to bytes for SpectralProcessor
-        # SpectralProcessor expects bytes, not a file path
-        success, encoded_image = cv2.imencode('.jpg', image)
-        if not success:
+        if not image_bytes:
             return jsonify({
                 'success': False,
-                'error': 'Failed to encode image'
+                'error': 'No image data provided'
             }), 400
         
-        image_bytes_processed = encoded_image.tobytes()
-        print(f"Converted to bytes: {len(image_bytes_processed)} bytes", file=sys.stderr)
-        
-        # Process with SpectralProcessor (pass bytes, not file path)
-        processor = SpectralProcessor(image_bytes_processed)
-        result = processor.process(force_analysis=force_analysis)
+        force_analysis = request.args.get('force_analysis', '').lower() in ('1', 'true')
+        logger.debug("Received raw image: %d bytes", len(image_bytes))
         
-        print("Processing complete", file=sys.stderr)
-        
-        return jsonify(result)
+        return run_processor(image_bytes, force_analysis)
         
     except Exception as e:
-        print(f"Error processing image: {e}", file=sys.stderr)
-        traceback.print_exc()
+        logger.exception("Error processing image")
         
         return jsonify({
             'success': False,
@@ -158,28 +259,14 @@ def process_file():
                 'error': 'Empty filename'
             }), 400
         
-        # Save to temporary file (cross-platform)
-        temp_fd, temp_path = tempfile.mkstemp(suffix='.jpg', prefix='spectral_upload_')
-        os.close(temp_fd)  # Close the file descriptor
-        
-        file.save(temp_path)
-        print(f"Saved upload to: {temp_path}", file=sys.stderr)
-        
-        # Process with SpectralProcessor
-        processor = SpectralProcessor(temp_path)
-        result = processor.process()
+        # Read the upload straight into memory - no temp file round trip
+        image_bytes = file.read()
+        logger.debug("Received upload: %d bytes", len(image_bytes))
         
-        # Clean up
-        try:
-            os.unlink(temp_path)
-        except:
-            pass
-        
-        return jsonify(result)
+        return run_processor(image_bytes)
         
     except Exception as e:
-        print(f"Error processing file: {e}", file=sys.stderr)
-        traceback.print_exc()
+        logger.exception("Error processing file")
         
         return jsonify({
             'success': False,
@@ -189,6 +276,10 @@ def process_file():
 
 
 if __name__ == '__main__':
+    # Warnings and errors only - per-request INFO/DEBUG lines stay no-ops
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    
     print("=" * 60)
     print("Spectral Processing Server")
     print("=" * 60)
@@ -196,6 +287,7 @@ if __name__ == '__main__':
     print("Endpoints:")
     print("  GET  /health         - Health check")
     print("  POST /process        - Process base64 image")
+    print("  POST /process-raw    - Process raw image bytes")
     print("  POST /process-file   - Process uploaded file")
     print()
     print("Starting server on http://0.0.0.0:5000")
@@ -204,4 +296,9 @@ if __name__ == '__main__':
     
     # Run server
     # Use 0.0.0.0 to allow connections from phone
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    try:
+        from waitress import serve
+    except ImportError:  # waitress is optional - fall back to Flask's threaded server
+        app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+    else:
+        serve(app, host='0.0.0.0', port=5000, threads=max(4, os.cpu_count() or 1))
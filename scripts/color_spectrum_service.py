@@ -6,19 +6,126 @@ import sys
 import json
 import base64
 from io import BytesIO
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import numpy as np
-from PIL import Image
-from collections import Counter
+
+try:
+    import cv2
+except ImportError:  # OpenCV is optional - decoding falls back to Pillow
+    cv2 = None
+
+try:
+    from sklearn.cluster import KMeans
+except ImportError:  # scikit-learn is optional - clustering falls back to OpenCV
+    KMeans = None
+
+Image = None
+if cv2 is None:
+    try:
+        from PIL import Image
+    except ImportError:  # Without OpenCV, Pillow decodes the images
+        pass
+
+# Clustering implementation, chosen once at import: scikit-learn, OpenCV, or
+# plain color quantization. scikit-learn comes first - its greedy k-means++
+# seeding finds better minima on chart images than cv2.kmeans at the same cost
+if KMeans is not None:
+    _CLUSTER_BACKEND = 'sklearn'
+elif cv2 is not None:
+    _CLUSTER_BACKEND = 'cv2'
+else:
+    _CLUSTER_BACKEND = 'simple'
 
 # Note: Install required packages with:
-# pip install pillow numpy opencv-python scikit-learn
+# pip install numpy opencv-python scikit-learn
+# (without OpenCV, Pillow is needed to decode images)
+
+# k-means++ seeded runs per clustering, best kept: a single run can merge
+# two chart colors, but beyond three restarts the centers stop moving
+KMEANS_RUNS = 3
+
+COLOR_LABELS = [
+    'Primary Spectrum',
+    'Secondary Spectrum',
+    'Tertiary Spectrum',
+    'Quaternary Spectrum',
+    'Quinary Spectrum'
+]
 
 def rgb_to_hex(rgb: Tuple[int, int, int]) -> str:
     """Convert RGB tuple to hex color code."""
     return '#{:02x}{:02x}{:02x}'.format(rgb[0], rgb[1], rgb[2])
 
 
+def jpeg_size(img_bytes: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Read (width, height) from a JPEG's frame header without decoding it.
+    Returns None if the data is not a JPEG or no frame header is found.
+    
+    Mirrors the JPEG branch of _encoded_size in python/spectral_processor.py,
+    the canonical parser. This script is deployed on its own and can't
+    import the server package, so change both together.
+    """
+    if img_bytes[:2] != b'\xff\xd8':
+        return None
+    
+    pos = 2
+    while pos + 9 <= len(img_bytes):
+        if img_bytes[pos] != 0xFF:
+            return None
+        marker = img_bytes[pos + 1]
+        
+        if marker == 0xFF:  # Fill byte
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # Standalone, no length
+            pos += 2
+            continue
+        
+        # SOF0-SOF15, excluding DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(img_bytes[pos + 5:pos + 7], 'big')
+            width = int.from_bytes(img_bytes[pos + 7:pos + 9], 'big')
+            return width, height
+        
+        pos += 2 + int.from_bytes(img_bytes[pos + 2:pos + 4], 'big')
+    
+    return None
+
+
+def decode_thumbnail(img_bytes: bytes, max_size: int = 200) -> np.ndarray:
+    """
+    Decode an image with OpenCV and shrink it to fit max_size, as RGB.
+    
+    JPEGs are decoded at the largest libjpeg reduction (1/8, 1/4, 1/2)
+    that still leaves at least max_size, like PIL's draft mode, then
+    area-averaged down. The reduction is picked from the frame header, so
+    there is a single decode. Other formats are decoded at full size.
+    """
+    flag = cv2.IMREAD_COLOR
+    size = jpeg_size(img_bytes)
+    
+    if size is not None:
+        full_size = max(size)
+        for reduction, reduced_flag in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                                        (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                        (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if -(-full_size // reduction) >= max_size:
+                flag = reduced_flag
+                break
+    
+    img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), flag)
+    
+    if img is None:
+        raise ValueError('Failed to decode image')
+    
+    scale = max_size / max(img.shape[:2])
+    if scale < 1:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
 def get_dominant_colors(image_path: str, num_colors: int = 5) -> List[Dict]:
     """
     Extract dominant colors from an image using k-means clustering.
@@ -39,97 +146,153 @@ def get_dominant_colors(image_path: str, num_colors: int = 5) -> List[Dict]:
             else:
                 image_data = image_path
             img_bytes = base64.b64decode(image_data)
-            img = Image.open(BytesIO(img_bytes))
         else:
             # Handle file path
-            img = Image.open(image_path)
-        
-        # Convert to RGB if necessary
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Resize image for faster processing
-        img.thumbnail((200, 200))
+            with open(image_path, 'rb') as f:
+                img_bytes = f.read()
         
-        # Convert to numpy array
-        img_array = np.array(img)
-        pixels = img_array.reshape(-1, 3)
-        
-        # Use k-means clustering to find dominant colors
-        try:
-            from sklearn.cluster import KMeans
-            
-            kmeans = KMeans(n_clusters=num_colors, random_state=42, n_init=10)
-            kmeans.fit(pixels)
-            
-            # Get cluster centers (dominant colors)
-            colors = kmeans.cluster_centers_.astype(int)
-            
-            # Count pixels in each cluster
-            labels = kmeans.labels_
-            label_counts = Counter(labels)
-            total_pixels = len(labels)
-            
-            # Create result list
-            color_data = []
-            color_names = [
-                'Primary Spectrum',
-                'Secondary Spectrum', 
-                'Tertiary Spectrum',
-                'Quaternary Spectrum',
-                'Quinary Spectrum'
-            ]
+        if cv2 is not None:
+            # Decode and resize in OpenCV - the rest of the pipeline is NumPy
+            img_array = decode_thumbnail(img_bytes, 200)
+        elif Image is not None:
+            img = Image.open(BytesIO(img_bytes))
             
-            for i, (label, count) in enumerate(sorted(label_counts.items(), 
-                                                      key=lambda x: x[1], 
-                                                      reverse=True)):
-                color_rgb = tuple(colors[label])
-                percentage = round((count / total_pixels) * 100, 1)
-                
-                color_data.append({
-                    'color': rgb_to_hex(color_rgb),
-                    'rgb': color_rgb,
-                    'percentage': percentage,
-                    'label': color_names[i] if i < len(color_names) else f'Color {i+1}'
-                })
+            # Convert to RGB if necessary
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
             
-            return color_data
+            # Resize image for faster processing
+            img.thumbnail((200, 200))
             
-        except ImportError:
-            # Fallback: Simple color sampling if sklearn is not available
+            # Convert to numpy array
+            img_array = np.array(img)
+        else:
+            raise ImportError("Decoding images needs opencv-python or pillow")
+        
+        pixels = img_array.reshape(-1, 3)
+        
+        # Use k-means clustering to find dominant colors, preferring
+        # scikit-learn and falling back to OpenCV's implementation
+        if _CLUSTER_BACKEND == 'sklearn':
+            return sklearn_color_analysis(pixels, num_colors)
+        elif _CLUSTER_BACKEND == 'cv2':
+            return cv2_color_analysis(pixels, num_colors)
+        else:
+            # Fallback: Simple color sampling if no clustering library is available
             return simple_color_analysis(pixels, num_colors)
-            
+        
     except Exception as e:
         print(f"Error analyzing image: {e}", file=sys.stderr)
         return []
 
 
+def sklearn_color_analysis(pixels: np.ndarray, num_colors: int = 5) -> List[Dict]:
+    """
+    K-means color analysis with scikit-learn.
+    """
+    kmeans = KMeans(n_clusters=num_colors, init='k-means++', n_init=KMEANS_RUNS,
+                    max_iter=50, tol=1e-3, random_state=42)
+    kmeans.fit(pixels)
+    
+    return cluster_color_data(kmeans.cluster_centers_, kmeans.labels_, num_colors)
+
+
+def cv2_color_analysis(pixels: np.ndarray, num_colors: int = 5) -> List[Dict]:
+    """
+    K-means color analysis with OpenCV.
+    Deterministic across calls without reseeding OpenCV's global RNG.
+    """
+    # cv2.kmeans refills empty clusters with single stolen points, so an
+    # image with fewer distinct colors than k would report duplicates
+    keys = (pixels[:, 0].astype(np.int32) << 16) | (pixels[:, 1].astype(np.int32) << 8) | pixels[:, 2]
+    num_colors = min(num_colors, len(np.unique(keys)))
+    
+    data = pixels.astype(np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+    rng = np.random.default_rng(42)
+    best = None
+    
+    # cv2.kmeans would seed restarts from the process-wide RNG, so each run
+    # starts from our own k-means++ labels instead
+    for _ in range(KMEANS_RUNS):
+        initial = kmeans_pp_labels(data, num_colors, rng)
+        run = cv2.kmeans(data, num_colors, initial, criteria, 1, cv2.KMEANS_USE_INITIAL_LABELS)
+        if best is None or run[0] < best[0]:
+            best = run
+    
+    _, labels, centers = best
+    return cluster_color_data(centers, labels.ravel(), num_colors)
+
+
+def kmeans_pp_labels(data: np.ndarray, num_colors: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Pick k-means++ seed centers from the data and label each point with its
+    nearest seed, as an int32 column for cv2.KMEANS_USE_INITIAL_LABELS.
+    """
+    labels = np.zeros(len(data), dtype=np.int32)
+    dist = ((data - data[rng.integers(len(data))]) ** 2).sum(axis=1)
+    
+    for label in range(1, num_colors):
+        # Sample the next seed with probability proportional to squared distance
+        cumulative = np.cumsum(dist, dtype=np.float64)
+        index = int(np.searchsorted(cumulative, rng.random() * cumulative[-1], side='right'))
+        index = min(index, len(data) - 1)
+        
+        seed_dist = ((data - data[index]) ** 2).sum(axis=1)
+        closer = seed_dist < dist
+        labels[closer] = label
+        dist = np.where(closer, seed_dist, dist)
+    
+    return labels.reshape(-1, 1)
+
+
+def cluster_color_data(centers: np.ndarray, labels: np.ndarray, num_colors: int) -> List[Dict]:
+    """
+    Build the color list from k-means centers and per-pixel cluster labels.
+    Clusters are ordered by pixel count, largest first; empty ones are dropped.
+    """
+    # Count pixels in each cluster in one pass, then order the few clusters
+    counts = np.bincount(labels, minlength=num_colors)
+    order = np.argsort(-counts, kind='stable')
+    total_pixels = len(labels)
+    
+    color_data = []
+    
+    for i, label in enumerate(order[counts[order] > 0]):
+        color_rgb = tuple(int(c) for c in centers[label])
+        percentage = round((int(counts[label]) / total_pixels) * 100, 1)
+        
+        color_data.append({
+            'color': rgb_to_hex(color_rgb),
+            'rgb': color_rgb,
+            'percentage': percentage,
+            'label': COLOR_LABELS[i] if i < len(COLOR_LABELS) else f'Color {i+1}'
+        })
+    
+    return color_data
+
+
 def simple_color_analysis(pixels: np.ndarray, num_colors: int = 5) -> List[Dict]:
     """
     Simple color analysis fallback without sklearn.
     Groups colors by quantization.
     """
-    # Quantize colors to reduce variations
-    quantized = (pixels // 32) * 32
+    # Quantize colors to 8 levels per channel, packed into one 9-bit key
+    quantized = (pixels // 32).astype(np.intp)
+    keys = (quantized[:, 0] << 6) | (quantized[:, 1] << 3) | quantized[:, 2]
     
-    # Count color frequencies
-    unique_colors, counts = np.unique(quantized, axis=0, return_counts=True)
+    # Count color frequencies in a single pass
+    counts = np.bincount(keys, minlength=512)
     
-    # Sort by frequency
-    sorted_indices = np.argsort(counts)[::-1]
-    top_colors = unique_colors[sorted_indices][:num_colors]
-    top_counts = counts[sorted_indices][:num_colors]
+    # Sort by frequency, dropping colors that never occur
+    top_keys = np.argsort(-counts, kind='stable')[:num_colors]
+    top_keys = top_keys[counts[top_keys] > 0]
+    top_counts = counts[top_keys].tolist()
+    top_colors = np.stack([top_keys >> 6, (top_keys >> 3) & 7, top_keys & 7], axis=1) * 32
     
-    total = np.sum(top_counts)
+    total = sum(top_counts)
     
     color_data = []
-    color_names = [
-        'Primary Spectrum',
-        'Secondary Spectrum',
-        'Tertiary Spectrum',
-        'Quaternary Spectrum',
-        'Quinary Spectrum'
-    ]
     
     for i, (color, count) in enumerate(zip(top_colors, top_counts)):
         percentage = round((count / total) * 100, 1)
@@ -137,7 +300,7 @@ def simple_color_analysis(pixels: np.ndarray, num_colors: int = 5) -> List[Dict]
             'color': rgb_to_hex(tuple(color)),
             'rgb': tuple(map(int, color)),
             'percentage': percentage,
-            'label': color_names[i] if i < len(color_names) else f'Color {i+1}'
+            'label': COLOR_LABELS[i] if i < len(COLOR_LABELS) else f'Color {i+1}'
         })
     
     return color_data
@@ -147,18 +310,12 @@ def analyze_color_temperature(colors: List[Dict]) -> str:
     """
     Analyze the overall color temperature of the image.
     """
-    warm_weight = 0
-    cool_weight = 0
+    rgb = np.array([color_info['rgb'] for color_info in colors], dtype=np.int16).reshape(-1, 3)
+    weights = np.array([color_info['percentage'] for color_info in colors], dtype=np.float64) / 100
     
-    for color_info in colors:
-        r, g, b = color_info['rgb']
-        weight = color_info['percentage'] / 100
-        
-        # Warm colors have more red/yellow
-        if r > b:
-            warm_weight += weight
-        else:
-            cool_weight += weight
+    # Warm colors have more red/yellow
+    warm_weight = float(weights @ (rgb[:, 0] > rgb[:, 2]))
+    cool_weight = float(weights.sum()) - warm_weight
     
     if warm_weight > cool_weight * 1.2:
         return 'warm'
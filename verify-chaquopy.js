@@ -62,11 +62,10 @@ if (fs.existsSync('python/spectral_processor.py')) {
   }
   
   if (pythonContent.includes('import cv2') && 
-      pythonContent.includes('import numpy') && 
-      pythonContent.includes('from scipy')) {
+      pythonContent.includes('import numpy')) {
     checks.push('✅ Python dependencies imported correctly');
   } else {
-    errors.push('❌ Python missing required imports (cv2, numpy, scipy)');
+    errors.push('❌ Python missing required imports (cv2, numpy)');
   }
 } else {
   errors.push('❌ python/spectral_processor.py not found');